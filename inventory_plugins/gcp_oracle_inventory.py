@@ -18,7 +18,14 @@ from ansible.errors import AnsibleParserError
 import yaml
 import os
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 DEFAULT_HOSTGROUP_NAME = 'dbasm'
+SI_REQUIRED_VARS = ('instance_hostname', 'instance_ip_addr')
+DG_REQUIRED_VARS = SI_REQUIRED_VARS + ('primary_ip_addr',)
 
 class InventoryModule(BaseInventoryPlugin):
     NAME = 'gcp_oracle_inventory'
@@ -43,7 +50,7 @@ class InventoryModule(BaseInventoryPlugin):
         '''Read the YAML configuration file'''
         try:
             with open(path, 'r') as f:
-                self.config_data = yaml.safe_load(f)
+                self.config_data = yaml.load(f, Loader=SafeLoader)
             if not isinstance(self.config_data, dict):
                 raise AnsibleParserError('Invalid YAML configuration: Expected a dictionary but got %s' % type(self.config_data))
         except Exception as e:
@@ -69,21 +76,22 @@ class InventoryModule(BaseInventoryPlugin):
                         raise AnsibleParserError("Missing 'host_ip' for node #%d in cluster #%d." % (j+1, i+1))
 
         elif cluster_type == 'DG':
-            required_vars = ['instance_hostname', 'instance_ip_addr', 'primary_ip_addr']
-            for var in required_vars:
-                if var not in self.config_data:
-                    raise AnsibleParserError("Missing required variable '%s' for Data Guard installation." % var)
+            self._check_required_vars(DG_REQUIRED_VARS, 'Data Guard')
         else: # Single Instance
-            required_vars = ['instance_hostname', 'instance_ip_addr']
-            for var in required_vars:
-                if var not in self.config_data:
-                    raise AnsibleParserError("Missing required variable '%s' for Single Instance installation." % var)
+            self._check_required_vars(SI_REQUIRED_VARS, 'Single Instance')
+
+    def _check_required_vars(self, required_vars, installation_type):
+        '''Raise an error for the first required variable missing from the config'''
+        for var in required_vars:
+            if var not in self.config_data:
+                raise AnsibleParserError("Missing required variable '%s' for %s installation." % (var, installation_type))
 
     def _populate_inventory(self):
         '''Populate the inventory based on the user-provided cluster-type'''
-        if self.config_data.get('ora_cluster_type') == 'RAC':
+        cluster_type = self.config_data.get('ora_cluster_type')
+        if cluster_type == 'RAC':
             self._populate_rac_inventory()
-        elif self.config_data.get('ora_cluster_type') == 'DG':
+        elif cluster_type == 'DG':
             self._populate_dg_inventory()
         else:
             self._populate_si_inventory()
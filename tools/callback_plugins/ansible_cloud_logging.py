@@ -3,31 +3,48 @@
 from __future__ import annotations  # required for annotations in TypeDicts
 
 import atexit
-import datetime
+import collections
 import getpass
 import os
-import queue
 import json
+import random
 import sys
 import threading
-from typing import Any, Dict, Optional, TypedDict
+import time
+from typing import Any, Dict, Mapping, Optional, TypedDict
 import uuid
 
 import ansible
 from ansible import context
 
-# Ansible plugins and modules import utilities from a special namespace that doesn't
-# follow standard Python import behavior. At runtime, Ansible dynamically builds this
-# namespace (ansible_collections) by combining built-in utilities and any found in installed collections.
-# You must run the plugin within Ansible for the imports to work correctly.
-# Ansible sets up the import paths and injects collection-based utilities at runtime.
-# See more details here: https://docs.ansible.com/ansible/latest/dev_guide/developing_module_utilities.html#using-and-developing-module-utilities.
-from ansible.module_utils.parsing import convert_bool
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
 from ansible.plugins import callback
-from ansible_collections.google.cloud.plugins.module_utils.gcp_utils import GcpSession
+import requests
 
 
 MAX_RESULT_SIZE = 256 * 1024  # 256 KB
+# Longer string fields of a task result (e.g. stdout) are truncated to this many characters.
+MAX_RESULT_FIELD_SIZE = 32 * 1024  # 32 KB
+# entries:write accepts at most 1000 entries and 10 MB per request; stay below both.
+MAX_ENTRIES_PER_REQUEST = 900
+MAX_REQUEST_SIZE = 9 * 1024 * 1024  # 9 MB
+ENTRIES_WRITE_URL = "https://logging.googleapis.com/v2/entries:write"
+LOGGING_WRITE_SCOPE = "https://www.googleapis.com/auth/logging.write"
+REQUEST_TIMEOUT = 30  # seconds
+# Transient entries:write failures are retried with exponential backoff.
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+MAX_SEND_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0  # seconds
+MAX_RETRY_DELAY = 60.0  # seconds
+# After a request has used up its retries, later requests are skipped for this long.
+CIRCUIT_BREAKER_COOLDOWN = 60.0  # seconds
+# Environment variables included in the playbook start message.
+LOGGED_ENV_PREFIXES = ("ANSIBLE",)
+LOGGED_ENV_VARS = frozenset({"PATH", "USER"})
 
 DOCUMENTATION = """
   name: ansible_cloud_logging
@@ -80,9 +97,166 @@ DOCUMENTATION = """
       ini:
         - section: cloud_logging
           key: enable_async_logging
+    batch_max_entries:
+      description: Maximum number of log messages the background thread collects
+        before sending them in a single request. Only used if enable_async_logging is True.
+      type: int
+      default: 900
+      env:
+        - name: ANSIBLE_CLOUD_LOGGING_BATCH_MAX_ENTRIES
+      ini:
+        - section: cloud_logging
+          key: batch_max_entries
+    batch_flush_interval:
+      description: Maximum number of seconds the background thread waits for more
+        log messages before sending a partially filled batch. Only used if
+        enable_async_logging is True.
+      type: float
+      default: 1.0
+      env:
+        - name: ANSIBLE_CLOUD_LOGGING_BATCH_FLUSH_INTERVAL
+      ini:
+        - section: cloud_logging
+          key: batch_flush_interval
+    worker_threads:
+      description: Number of background threads sending log messages in parallel.
+        Values above 1 increase throughput but log messages may reach Cloud Logging
+        out of order. Only used if enable_async_logging is True.
+      type: int
+      default: 1
+      env:
+        - name: ANSIBLE_CLOUD_LOGGING_WORKER_THREADS
+      ini:
+        - section: cloud_logging
+          key: worker_threads
+    emit_task_starts:
+      description: If True, a PLAYBOOK_TASK_START message is sent whenever a task starts
+        on a host. Disable it to halve the number of log messages for large playbooks;
+        the PLAYBOOK_TASK_END message still contains the start time of every task.
+      type: bool
+      default: True
+      env:
+        - name: ANSIBLE_CLOUD_LOGGING_EMIT_TASK_STARTS
+      ini:
+        - section: cloud_logging
+          key: emit_task_starts
+    sink:
+      description: Where log messages are written to. C(api) sends them to the Cloud
+        Logging API. C(file) appends them as newline-delimited JSON to sink_file,
+        for a logging agent that tails files (e.g. the Ops Agent or Fluent Bit) to
+        ship to Cloud Logging. C(stdout) writes the same lines to standard output,
+        interleaved with the stdout callback's output, for container runtimes
+        that collect a process's standard output. Both keep the playbook
+        independent of the availability and latency of the Cloud Logging API.
+      type: str
+      default: api
+      choices: [api, stdout, file]
+      env:
+        - name: ANSIBLE_CLOUD_LOGGING_SINK
+      ini:
+        - section: cloud_logging
+          key: sink
+    sink_file:
+      description: Path of the file log messages are appended to. Required if sink is C(file).
+      type: path
+      env:
+        - name: ANSIBLE_CLOUD_LOGGING_SINK_FILE
+      ini:
+        - section: cloud_logging
+          key: sink_file
 """
 
 
+def _json_dumps(obj: Any) -> bytes:
+  """Serializes an object to UTF-8 encoded JSON.
+
+  Uses orjson if it is installed, which is considerably faster than the json
+  module for the large result dictionaries of Ansible tasks.
+
+  Args:
+    obj: The object to serialize.
+
+  Returns:
+    The JSON document as bytes.
+  """
+  if orjson is not None:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+  return json.dumps(obj).encode("utf-8")
+
+
+def _truncate_string_fields(fields: dict[str, Any]) -> dict[str, Any]:
+  """Truncates the oversized top-level string values of a dictionary.
+
+  Strings longer than MAX_RESULT_FIELD_SIZE are cut off with a marker, and the
+  matching "<field>_lines" list, which repeats the same output, is dropped.
+
+  Args:
+    fields: The dictionary to truncate. It is not modified.
+
+  Returns:
+    The dictionary itself if nothing had to be truncated, otherwise a shallow
+    copy with the oversized values truncated.
+  """
+  truncated = None
+  for key, value in fields.items():
+    if isinstance(value, str) and len(value) > MAX_RESULT_FIELD_SIZE:
+      if truncated is None:
+        truncated = dict(fields)
+      truncated[key] = (
+          f"{value[:MAX_RESULT_FIELD_SIZE]}"
+          f"...[truncated {len(value) - MAX_RESULT_FIELD_SIZE} characters]"
+      )
+      truncated.pop(f"{key}_lines", None)
+  return fields if truncated is None else truncated
+
+
+def _truncate_result_fields(result: dict[str, Any]) -> dict[str, Any]:
+  """Truncates oversized string fields of a task result.
+
+  Module output such as stdout, stderr or diffs can be megabytes long, which
+  bloats every request and usually pushes the whole result over
+  MAX_RESULT_SIZE. Both the top-level fields and, for loop tasks, the fields
+  of every per-item result in "results" are truncated by
+  _truncate_string_fields().
+
+  Args:
+    result: The result dictionary of an Ansible task. It is not modified.
+
+  Returns:
+    The result itself if nothing had to be truncated, otherwise a shallow copy
+    with the oversized fields truncated.
+  """
+  truncated = _truncate_string_fields(result)
+  items = result.get("results")
+  if isinstance(items, list):
+    truncated_items = [
+        _truncate_string_fields(item) if isinstance(item, dict) else item
+        for item in items
+    ]
+    if any(new is not old for new, old in zip(truncated_items, items)):
+      if truncated is result:
+        truncated = dict(result)
+      truncated["results"] = truncated_items
+  return truncated
+
+
+def _time_now() -> str:
+  """Returns the current ISO 8601 timestamp for the UTC timezone.
+
+  Formats time.time_ns() directly, which is considerably cheaper than creating
+  a timezone-aware datetime object and calling isoformat() on it.
+
+  Returns:
+    A string representing the current datetime in the format ISO 8601 UTC,
+    e.g. 2024-01-31T12:34:56.123456+00:00.
+  """
+  seconds, microseconds = divmod(time.time_ns() // 1000, 1_000_000)
+  return (
+      f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}"
+      f".{microseconds:06d}+00:00"
+  )
+
+
 def _print_uuid(execution_id: str) -> None:
   """Prints the UUID of the logging entry.
 
@@ -217,29 +391,80 @@ class CloudLoggingCollector:
   the log_name. Log messages can be submitted using CloudLoggingCollector.send(msg). 
   If enable_async_logging is set to True, messages are queued and processed by 
   a background thread started via start_consuming(). Otherwise, messages are sent synchronously. 
-  The separate worker thread running in the background will consume the queue 
-  until a "None" message has been received. Make sure to run start_consuming() 
+  The worker_threads separate worker threads running in the background will consume
+  the queue until wait() has been called and the queue is empty. Queued messages are collected into
+  batches of up to batch_max_entries messages, waiting at most batch_flush_interval
+  seconds for a batch to fill up, and each batch is sent with a single request.
+  All requests share one HTTP session, so connections are kept alive and reused.
+  If sink is "stdout" or "file", messages are written as newline-delimited JSON
+  to standard output or sink_file instead of being sent to the API. Make sure to run start_consuming() 
   after initializing the instance of CloudLoggingCollector to start all necessary worker threads.
 
   Attributes:
     project: The Google Cloud project ID where logs will be sent.
     log_name: The log ID of the log entry name.
+    log_name_path: The full resource name of the log, sent as logName.
+    resource: The monitored resource all log entries are written to.
+    request_prefix: Serialized request-level fields that start every request body.
     enable_async_logging: If True, log messages are queued and sent by a background thread 
       to avoid blocking Ansible execution. If False, messages are sent
       synchronously as they are emitted.
     ignore_gcp_api_errors: If enabled, GCP API errors are ignored and do not cause Ansible to fail.
-    params: Parameters for the GcpSession class.
+    batch_max_entries: Maximum number of queued messages sent in one request.
+    batch_flush_interval: Maximum number of seconds to wait for a batch to fill up.
+    worker_threads: Number of background threads that process the queue.
     queue: Holds log messages when async logging is enabled.
-    gcp_session: Handles authenticated communication with the Google Cloud Logging API.
-    consumer: Background thread that processes log messages from the queue.
+    queue_cv: Signals the consumer threads about new messages and shutdown.
+    closed: Set by wait() to tell the consumer threads to exit once the queue is empty.
+    sink: Where log messages are written to: "api", "stdout" or "file".
+    sink_fd: File descriptor newline-delimited JSON is written to, or None if
+      sink is "api".
+    http_session: Authorized HTTP session shared by all requests, with a
+      connection pool sized for worker_threads. It caches the access token
+      of the application default credentials and refreshes it before it
+      expires. None unless sink is "api", or if no credentials could be
+      loaded.
+    circuit_open_until: time.monotonic() value until which requests are
+      skipped because an earlier request used up all of its retries.
+    consumers: Background threads that process log messages from the queue.
+    send: Public method to submit a log message. Bound to _enqueue() if
+      enable_async_logging is True and to _send_now() otherwise.
   """
 
+  __slots__ = (
+      "project",
+      "log_name",
+      "log_name_path",
+      "resource",
+      "request_prefix",
+      "enable_async_logging",
+      "ignore_gcp_api_errors",
+      "batch_max_entries",
+      "batch_flush_interval",
+      "worker_threads",
+      "sink",
+      "sink_fd",
+      "http_session",
+      "circuit_open_until",
+      "queue",
+      "queue_cv",
+      "closed",
+      "consumers",
+      "send",
+  )
+
   def __init__(
       self,
       project: str,
       log_name: str,
       enable_async_logging: bool,
       ignore_gcp_api_errors: bool = False,
+      batch_max_entries: int = MAX_ENTRIES_PER_REQUEST,
+      batch_flush_interval: float = 1.0,
+      worker_threads: int = 1,
+      labels: Optional[dict[str, str]] = None,
+      sink: str = "api",
+      sink_file: Optional[str] = None,
   ):
     """Initializes the CloudLoggingCollector instance.
 
@@ -250,106 +475,355 @@ class CloudLoggingCollector:
         to avoid blocking Ansible execution. If False, messages are sent
         synchronously as they are emitted.
       ignore_gcp_api_errors: If enabled, GCP API errors are ignored and do not cause Ansible to fail.
+      batch_max_entries: Maximum number of queued messages sent in one request.
+      batch_flush_interval: Maximum number of seconds to wait for a batch to fill up.
+      worker_threads: Number of background threads that process the queue.
+      labels: Labels added to every log entry written by this collector.
+      sink: Where log messages are written to: "api", "stdout" or "file".
+      sink_file: Path of the file log messages are appended to if sink is "file".
     """
     self.project = project
     self.log_name = log_name
+    # logName and resource never change for the lifetime of the collector.
+    self.log_name_path = f"projects/{project}/logs/{log_name}"
+    self.resource = {
+        "type": "global",
+        "labels": {
+            "project_id": project,
+        },
+    }
+    # Requests are assembled from already serialized payloads, so serialize the
+    # request-level fields once as the opening part of the JSON body.
+    # partialSuccess makes the API write all valid entries of a batch even if
+    # some of them are rejected. Request-level labels are added to every entry
+    # by the API, so they are sent once per request instead of once per entry.
+    request_fields = {
+        "logName": self.log_name_path,
+        "resource": self.resource,
+        "partialSuccess": True,
+    }
+    if labels:
+      request_fields["labels"] = labels
+    self.request_prefix = _json_dumps(request_fields)[:-1] + b',"entries":['
     self.enable_async_logging = enable_async_logging
     self.ignore_gcp_api_errors = ignore_gcp_api_errors
-    self.params = {
-        "auth_kind": "application",
-        "scopes": "https://www.googleapis.com/auth/logging.write",
-    }
-    self.gcp_session = GcpSession(self, "logging")
+    self.batch_max_entries = max(1, batch_max_entries)
+    self.batch_flush_interval = batch_flush_interval
+    self.sink = sink
+    self.circuit_open_until = 0.0
+    if sink == "api":
+      self.worker_threads = max(1, worker_threads) if enable_async_logging else 1
+      self.sink_fd = None
+      # google-auth is imported here so that the local sinks, which never
+      # contact Google Cloud, work on hosts without it.
+      import google.auth
+      import google.auth.exceptions
+      from google.auth.transport.requests import AuthorizedSession
+
+      # Create a single authorized session so that all requests reuse pooled
+      # keep-alive connections and the cached access token, instead of looking
+      # up credentials and opening a new TLS connection per request.
+      try:
+        credentials, _ = google.auth.default(scopes=[LOGGING_WRITE_SCOPE])
+      except google.auth.exceptions.DefaultCredentialsError as e:
+        # Raising here would make Ansible skip the plugin with only a warning,
+        # regardless of ignore_gcp_api_errors.
+        self.http_session = None
+        self._report_error(f"Could not load Application Default Credentials: {e}")
+      else:
+        self.http_session = AuthorizedSession(credentials)
+        self.http_session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(pool_maxsize=self.worker_threads),
+        )
+    else:
+      # Local writes don't benefit from parallel workers, and a single writer
+      # keeps lines from interleaving.
+      self.worker_threads = 1
+      self.http_session = None
+      if sink == "stdout":
+        self.sink_fd = sys.stdout.fileno()
+      elif sink == "file":
+        if not sink_file:
+          raise ValueError('sink_file must be set if sink is "file"')
+        # The descriptor stays open for the lifetime of the process.
+        self.sink_fd = os.open(
+            sink_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+      else:
+        raise ValueError(f"Unsupported sink: {sink}")
     if self.enable_async_logging:
-      self.queue = queue.Queue()
-
-  def fail_json(self, **kwargs) -> None:
-    raise RuntimeError(kwargs.get("msg", "An error occurred, but no message was provided"))
+      # A deque guarded by a single condition variable is cheaper than
+      # queue.Queue, which takes several locks per put()/get(), and lets the
+      # consumers drain a whole batch at once.
+      self.queue = collections.deque()
+      self.queue_cv = threading.Condition()
+      self.closed = False
+    # send() is called for every Ansible event, so pick its implementation once
+    # instead of checking enable_async_logging on every call.
+    self.send = self._enqueue if self.enable_async_logging else self._send_now
 
   def start_consuming(self) -> None:
-    """Starts the background consumer thread.
+    """Starts the background consumer threads.
 
     If enable_async_logging is False, the method, is a no-op.
     """
     if self.enable_async_logging:
-      self.consumer = threading.Thread(target=self.consume)
-      self.consumer.start()
+      self.consumers = [
+          threading.Thread(target=self.consume)
+          for _ in range(self.worker_threads)
+      ]
+      for consumer in self.consumers:
+        consumer.start()
+
+  def _batches(
+      self,
+      payloads: list[
+          PlaybookStartMessage
+          | PlaybookTaskStartMessage
+          | PlaybookTaskEndMessage
+          | PlaybookEndMessage
+      ],
+  ):
+    """Splits payloads into batches that fit into a single entries:write request.
+
+    Args:
+      payloads: The payloads to be sent to Google Cloud Logging.
+
+    Yields:
+      Lists of JSON serialized payloads with at most MAX_ENTRIES_PER_REQUEST
+      entries and roughly MAX_REQUEST_SIZE bytes each.
+    """
+    batch = []
+    batch_size = 0
+    for payload in payloads:
+      serialized = _json_dumps(payload)
+      size = len(serialized)
+      if batch and (
+          len(batch) >= MAX_ENTRIES_PER_REQUEST
+          or batch_size + size > MAX_REQUEST_SIZE
+      ):
+        yield batch
+        batch = []
+        batch_size = 0
+      batch.append(serialized)
+      batch_size += size
+    if batch:
+      yield batch
+
+  def _post(self, body: bytes) -> requests.Response:
+    """Posts a request body to entries:write, retrying transient failures.
+
+    Rate limiting (429) and server errors (5xx) are retried up to
+    MAX_SEND_ATTEMPTS times with exponential backoff and jitter, honoring the
+    Retry-After header if the API sends one. Connection errors are retried the
+    same way, as are requests that time out after REQUEST_TIMEOUT seconds.
+
+    A request that still fails after its last attempt opens a circuit breaker:
+    for the next CIRCUIT_BREAKER_COOLDOWN seconds requests fail immediately,
+    and afterwards a single attempt is made until one gets through again. An
+    unreachable API therefore doesn't stall every event with the full backoff.
+
+    Args:
+      body: The serialized JSON request body.
+
+    Returns:
+      The response of the last attempt.
+
+    Raises:
+      requests.exceptions.RequestException: No response was received, or the
+        circuit breaker is open.
+    """
+    now = time.monotonic()
+    if now < self.circuit_open_until:
+      raise requests.exceptions.ConnectionError(
+          "Skipped because an earlier request to Google Cloud Logging failed"
+          f" all attempts; sending resumes in {self.circuit_open_until - now:.0f}s"
+      )
+    # Only probe with a single attempt right after the breaker was open.
+    max_attempts = 1 if self.circuit_open_until else MAX_SEND_ATTEMPTS
+    for attempt in range(1, max_attempts + 1):
+      try:
+        resp = self.http_session.post(
+            ENTRIES_WRITE_URL,
+            data=body,
+            headers={"Content-Type": "application/json"},
+            timeout=REQUEST_TIMEOUT,
+        )
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        if attempt == max_attempts:
+          self.circuit_open_until = time.monotonic() + CIRCUIT_BREAKER_COOLDOWN
+          raise
+        resp = None
+      if resp is not None:
+        if resp.status_code not in RETRYABLE_STATUS_CODES:
+          self.circuit_open_until = 0.0
+          return resp
+        if attempt == max_attempts:
+          self.circuit_open_until = time.monotonic() + CIRCUIT_BREAKER_COOLDOWN
+          return resp
+      delay = min(MAX_RETRY_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1) + random.random())
+      if resp is not None:
+        try:
+          delay = min(MAX_RETRY_DELAY, float(resp.headers["Retry-After"]))
+        except (KeyError, ValueError):
+          pass
+      time.sleep(delay)
+
+  def _write_ndjson(
+      self,
+      payloads: list[
+          PlaybookStartMessage
+          | PlaybookTaskStartMessage
+          | PlaybookTaskEndMessage
+          | PlaybookEndMessage
+      ],
+  ) -> None:
+    """Writes payloads as newline-delimited JSON to the local sink.
+
+    Args:
+      payloads: The payloads to be written, one JSON document per line.
+    """
+    data = memoryview(b"".join(_json_dumps(payload) + b"\n" for payload in payloads))
+    if self.sink == "stdout":
+      # The lines bypass sys.stdout, so flush whatever Ansible has buffered
+      # first to keep them from landing in the middle of its output.
+      sys.stdout.flush()
+    while data:
+      data = data[os.write(self.sink_fd, data):]
 
   def _send(
       self,
-      payload: (
+      payloads: list[
           PlaybookStartMessage
           | PlaybookTaskStartMessage
           | PlaybookTaskEndMessage
           | PlaybookEndMessage
-      ),
+      ],
   ) -> None:
-    """Sends a log entry to Google Cloud Logging."""
-    entry = {
-        "logName": f"projects/{self.project}/logs/{self.log_name}",
-        "resource": {
-            "type": "global",
-            "labels": {
-                "project_id": self.project,
-            },
-        },
-        "jsonPayload": payload,
-    }
-    entries = {"entries": [entry]}
-    resp = self.gcp_session.full_post(
-        "https://logging.googleapis.com/v2/entries:write",
-        json=entries,
-    )
-    if resp.status_code != 200:
+    """Sends log entries to Google Cloud Logging.
+
+    Entries are written with as few entries:write requests as possible. The
+    logName and resource are set once per request and are inherited by every
+    entry in it.
+
+    Args:
+      payloads: The payloads to be sent to Google Cloud Logging.
+    """
+    if self.sink_fd is not None:
+      self._write_ndjson(payloads)
+      return
+    if self.http_session is None:
+      # Missing credentials have already been reported by __init__().
+      return
+    for batch in self._batches(payloads):
+      # Each payload is serialized exactly once, in _batches().
+      body = b"".join((
+          self.request_prefix,
+          b",".join(b'{"jsonPayload":' + payload + b"}" for payload in batch),
+          b"]}",
+      ))
+      try:
+        resp = self._post(body)
+      except requests.exceptions.RequestException as e:
+        self._report_error(f"Failed to send {len(batch)} log entries: {e}")
+        continue
+      if resp.status_code != 200:
+        try:
+          response = resp.json()
+        except ValueError:
+          # Errors from proxies and load balancers often have an HTML or empty body.
+          response = resp.text
+        self._report_error(
+            f"Received status code: {resp.status_code}\n"
+            f"Response: {response}"
+        )
+
+  def _report_error(self, message: str) -> None:
+    """Reports a failed entries:write request.
+
+    Exits Ansible unless ignore_gcp_api_errors is enabled.
+
+    Args:
+      message: Description of the failure.
+    """
+    print(message)
+    if not self.ignore_gcp_api_errors:
       print(
-          f"Received status code: {resp.status_code}\n"
-          f"Response: {resp.json()}"
+          "The Ansible playbook execution was terminated due to an error"
+          " encountered while attempting to send execution logs to Google Cloud Logging.",
+          file=sys.stderr,
       )
-      if not self.ignore_gcp_api_errors:
-        print(
-            "The Ansible playbook execution was terminated due to an error"
-            " encountered while attempting to send execution logs to Google Cloud Logging.",
-            file=sys.stderr,
-        )
-        sys.exit(1)
+      sys.exit(1)
 
-  def send(
+  def _enqueue(
       self,
       payload: (
           PlaybookStartMessage
           | PlaybookTaskStartMessage
           | PlaybookTaskEndMessage
           | PlaybookEndMessage
-          | None
       ),
   ) -> None:
-    """Public send method to add a new log message to the queue.
+    """Adds a new log message to the queue; used as send() if enable_async_logging is True.
 
     Args:
       payload: The payload to be sent to Google Cloug Logging.
     """
-    if self.enable_async_logging:
-      self.queue.put(payload)
-      return
-    self._send(payload)
+    with self.queue_cv:
+      self.queue.append(payload)
+      self.queue_cv.notify()
+
+  def _send_now(
+      self,
+      payload: (
+          PlaybookStartMessage
+          | PlaybookTaskStartMessage
+          | PlaybookTaskEndMessage
+          | PlaybookEndMessage
+      ),
+  ) -> None:
+    """Sends a log message right away; used as send() if enable_async_logging is False.
+
+    Args:
+      payload: The payload to be sent to Google Cloug Logging.
+    """
+    self._send([payload])
 
   def consume(self):
-    """Consumes messages from the queue and sends them to Google Cloug Logging."""
+    """Consumes messages from the queue and sends them to Google Cloug Logging.
+
+    Blocks until a message is available, then keeps collecting messages until
+    the batch is full or batch_flush_interval has passed, and sends the whole
+    batch with a single request.
+    """
     while True:
-      msg = self.queue.get()
-      # if msg is None ensures that we break out of the loop to finish the
-      # consumer thread, because join() only finishes when the consumer thread
-      # is dead.
-      if msg is None:
-        break
-      self._send(msg)
-      self.queue.task_done()
+      with self.queue_cv:
+        self.queue_cv.wait_for(lambda: self.queue or self.closed)
+        # wait() has been called and everything has been sent, so finish the
+        # consumer thread; join() only finishes when the consumer thread is dead.
+        if not self.queue:
+          return
+        self.queue_cv.wait_for(
+            lambda: self.closed or len(self.queue) >= self.batch_max_entries,
+            timeout=self.batch_flush_interval,
+        )
+        batch = [
+            self.queue.popleft()
+            for _ in range(min(len(self.queue), self.batch_max_entries))
+        ]
+      if batch:
+        self._send(batch)
 
   def wait(self):
-    """Waits for the consumer thread to finish."""
+    """Stops the consumer threads once the queue is drained and waits for them to finish."""
+    with self.queue_cv:
+      self.closed = True
+      self.queue_cv.notify_all()
     # join() only finishes when the consumer thread finishes not when the queue
     # itself is empty.
-    self.consumer.join()
+    for consumer in self.consumers:
+      consumer.join()
 
 
 class CallbackModule(callback.CallbackBase):
@@ -359,7 +833,7 @@ class CallbackModule(callback.CallbackBase):
     super().__init__(display)
     # Required for collecting options set via environment variables.
     self.id = str(uuid.uuid4())
-    self.start_time = self._time_now()
+    self.start_time = _time_now()
     self.user = getpass.getuser()
     self.start_msg = PlaybookStartMessage(
         id="",
@@ -383,20 +857,30 @@ class CallbackModule(callback.CallbackBase):
     self.set_options()
     self.project = self.get_option("project")
     self.log_name = self.get_option("log_name")
-    # Convert string value from ansible.cfg to a proper boolean
-    self.ignore_gcp_api_errors = convert_bool.boolean(self.get_option("ignore_gcp_api_errors"))
-    self.print_uuid = convert_bool.boolean(self.get_option("print_uuid"))
-    self.enable_async_logging = convert_bool.boolean(
-        self.get_option("enable_async_logging")
-    )
+    # Ansible already converts values from ansible.cfg and the environment to
+    # the types declared in DOCUMENTATION.
+    self.ignore_gcp_api_errors = self.get_option("ignore_gcp_api_errors")
+    self.print_uuid = self.get_option("print_uuid")
+    self.enable_async_logging = self.get_option("enable_async_logging")
+    self.emit_task_starts = self.get_option("emit_task_starts")
     # The optional deployment_name is passed in by Terraform.
     self.deployment_name = os.environ.get("DEPLOYMENT_NAME", "UNSET_DEPLOYMENT_NAME")
+    # The environment doesn't change during the playbook execution, so filter
+    # it only once. _filter_env() builds a new dictionary, so the global env
+    # can't be written to accidentally.
+    self.env = self._filter_env(os.environ)
 
     self.logging_collector = CloudLoggingCollector(
         project=self.project,
         log_name=self.log_name,
         enable_async_logging=self.enable_async_logging,
         ignore_gcp_api_errors=self.ignore_gcp_api_errors,
+        batch_max_entries=self.get_option("batch_max_entries"),
+        batch_flush_interval=self.get_option("batch_flush_interval"),
+        worker_threads=self.get_option("worker_threads"),
+        labels={"playbook_id": self.id},
+        sink=self.get_option("sink"),
+        sink_file=self.get_option("sink_file"),
     )
     self.logging_collector.start_consuming()
 
@@ -427,15 +911,7 @@ class CallbackModule(callback.CallbackBase):
         task_keys=task_keys, var_options=var_options, direct=direct
     )
 
-  def _time_now(self) -> str:
-    """Returns the current ISO 8601 timestamp for the UTC timezone.
-
-    Returns:
-      A string representing the current datetime in the format ISO 8601 UTC.
-    """
-    return f"{datetime.datetime.now(datetime.timezone.utc).isoformat()}"
-
-  def _filter_env(self, env: dict[str, str]) -> dict[str, str]:
+  def _filter_env(self, env: Mapping[str, str]) -> dict[str, str]:
     """Filters out unnecessary environment variables before sending to Google Cloud Logging.
 
     Args:
@@ -444,11 +920,10 @@ class CallbackModule(callback.CallbackBase):
     Returns:
       A new dictionary containing only the environment variables relevant for logging.
     """
-    wanted_prefix = ("ANSIBLE")
     return {
         k: v
         for k, v in env.items()
-        if k.startswith(wanted_prefix) or k in {"PATH", "USER"}
+        if k.startswith(LOGGED_ENV_PREFIXES) or k in LOGGED_ENV_VARS
     }
 
   def _store_result_in_task(
@@ -462,30 +937,35 @@ class CallbackModule(callback.CallbackBase):
       result: The result object of type ansible.executor.result.Result
       status: The status of the task (OK, FAILED, SKIPPED, etc.)
     """
-    host = result._host
-    task = result._task
+    t = self.tasks[(result._host.get_name(), result._task._uuid)]
 
-    result_data = result._result.copy()
+    result_data = result._result
+    if self.enable_async_logging:
+      # The result is serialized later by a consumer thread, while other
+      # callbacks (e.g. the default stdout callback cleaning up results) may
+      # still modify it. Synchronous sends serialize it right away, so they
+      # don't need the copy.
+      result_data = result_data.copy()
+    result_data = _truncate_result_fields(result_data)
     # Replace results that exceed Cloud Logging's 256KB payload limit with a warning
-    serialized = json.dumps(result_data)
-    if len(serialized.encode('utf-8')) > MAX_RESULT_SIZE:
+    if len(_json_dumps(result_data)) > MAX_RESULT_SIZE:
         result_data = {
             "warning": f"Result omitted because it exceeded {MAX_RESULT_SIZE} bytes",
         }
-    self.tasks[(host.get_name(), task._uuid)]["result"] = result_data
-    self.tasks[(host.get_name(), task._uuid)]["end_time"] = self._time_now()
-    self.tasks[(host.get_name(), task._uuid)]["status"] = status
+    t["result"] = result_data
+    t["end_time"] = _time_now()
+    t["status"] = status
      # Setting WLM fields
     if status == "failed":
-      self.tasks[(host.get_name(), task._uuid)]["state"] = "failed"
-      self.tasks[(host.get_name(), task._uuid)]["error_message"] = result_data.get("stderr") or result_data.get("msg") or "No error message found in result (neither 'stderr' nor 'msg' present)."
+      t["state"] = "failed"
+      t["error_message"] = result_data.get("stderr") or result_data.get("msg") or "No error message found in result (neither 'stderr' nor 'msg' present)."
     elif status == "unreachable":
-      self.tasks[(host.get_name(), task._uuid)]["state"] = "failed"
-      self.tasks[(host.get_name(), task._uuid)]["error_message"] = "unreachable host"
+      t["state"] = "failed"
+      t["error_message"] = "unreachable host"
     elif status == "ok" or status == "skipped":
-      self.tasks[(host.get_name(), task._uuid)]["state"] = "success"
+      t["state"] = "success"
 
-    self.logging_collector.send(self.tasks[(host.get_name(), task._uuid)])
+    self.logging_collector.send(t)
 
   def v2_playbook_on_start(self, playbook: ansible.playbook.Playbook) -> None:
     """Plugin function that gets called when a playbook starts.
@@ -499,9 +979,7 @@ class CallbackModule(callback.CallbackBase):
     self.start_msg["user"] = self.user
     self.start_msg["start_time"] = self.start_time
     self.start_msg["id"] = self.id
-    self.start_msg["env"] = self._filter_env(
-        os.environ.copy()
-    )  # create a copy to avoid accidentally writing to global env
+    self.start_msg["env"] = self.env
     self.start_msg["playbook_name"] = playbook._file_name.rpartition("/")[2]
     self.start_msg["playbook_basedir"] = playbook._basedir
     if context.CLIARGS.get("inventory", False):
@@ -539,51 +1017,45 @@ class CallbackModule(callback.CallbackBase):
       host: The host object of type ansible.host.host
       task: The task object of type ansible.executor.task.Task
     """
-    time_now = self._time_now()
-    self.logging_collector.send(
-        PlaybookTaskStartMessage(
-            id=self.id,
-            event_type="PLAYBOOK_TASK_START",
-            task_id=task._uuid,
-            name=task.get_name(),
-            host=host.get_name(),
-            start_time=time_now,
-            # WLM fields
-            state="task_start",
-            deployment_name=self.deployment_name,
-            timestamp=time_now,
-            step_name=task.get_name(),
-        )
-    )
+    time_now = _time_now()
+    host_name = host.get_name()
+    task_name = task.get_name()
+    if self.emit_task_starts:
+      self.logging_collector.send(
+          PlaybookTaskStartMessage(
+              id=self.id,
+              event_type="PLAYBOOK_TASK_START",
+              task_id=task._uuid,
+              name=task_name,
+              host=host_name,
+              start_time=time_now,
+              # WLM fields
+              state="task_start",
+              deployment_name=self.deployment_name,
+              timestamp=time_now,
+              step_name=task_name,
+          )
+      )
 
     # Starts constructing event for task end.
-    t = PlaybookTaskEndMessage(
-        id="",
-        event_type="PLAYBOOK_TASK_END",
-        task_id="",
-        name="",
-        host="",
-        start_time="",
-        end_time="",
-        status="",
-        result={},
+    t: PlaybookTaskEndMessage = {
+        "id": self.id,
+        "event_type": "PLAYBOOK_TASK_END",
+        "task_id": task._uuid,
+        "name": task_name,
+        "host": host_name,
+        "start_time": time_now,
+        "end_time": "",
+        "status": "",
+        "result": {},
         # WLM fields
-        state="",
-        step_name="",
-        timestamp="",
-        deployment_name="",
-        error_message="",
-    )
-    t["id"] = self.id
-    t["task_id"] = task._uuid
-    t["name"] = task.get_name()
-    t["host"] = host.get_name()
-    t["start_time"] = time_now
-    # WLM fields
-    t["step_name"] = task.get_name()
-    t["timestamp"] = time_now
-    t["deployment_name"] = self.deployment_name
-    self.tasks[(host.get_name(), task._uuid)] = t
+        "state": "",
+        "step_name": task_name,
+        "timestamp": time_now,
+        "deployment_name": self.deployment_name,
+        "error_message": "",
+    }
+    self.tasks[(host_name, task._uuid)] = t
 
   def v2_runner_on_failed(
       self,
@@ -638,43 +1110,33 @@ class CallbackModule(callback.CallbackBase):
     Args:
       stats: The stats object of type ansible.executor.stats.AggregateStats
     """
-    msg = PlaybookEndMessage(
-        id="",
-        event_type="PLAYBOOK_END",
-        user="",
-        start_time="",
-        end_time="",
-        stats={},
-        # WLM fields
-        state="playbook_end",
-        deployment_name="",
-        timestamp="",
-        playbook_stats={},
-        file_name="",
-    )
     hosts = sorted(stats.processed.keys())
     summary = {}
     for h in hosts:
       s = stats.summarize(h)
       summary[h] = s
-    msg["id"] = self.id
-    msg["user"] = self.user
-    msg["start_time"] = self.start_time
-    msg["end_time"] = self._time_now()
-    msg["stats"] = summary
-    # WLM fields
-    msg["deployment_name"] = self.deployment_name
-    msg["timestamp"] = self._time_now()
-    msg["playbook_stats"] = {
-      'processed': stats.processed,
-      'failures': stats.failures,
-      'ok': stats.ok,
-      'unreachable': stats.dark,
-      'changed': stats.changed,
-      'skipped': stats.skipped,
+    end_time = _time_now()
+    msg: PlaybookEndMessage = {
+        "id": self.id,
+        "event_type": "PLAYBOOK_END",
+        "user": self.user,
+        "start_time": self.start_time,
+        "end_time": end_time,
+        "stats": summary,
+        # WLM fields
+        "state": "playbook_end",
+        "deployment_name": self.deployment_name,
+        "timestamp": end_time,
+        "playbook_stats": {
+          'processed': stats.processed,
+          'failures': stats.failures,
+          'ok': stats.ok,
+          'unreachable': stats.dark,
+          'changed': stats.changed,
+          'skipped': stats.skipped,
+        },
+        "file_name": self.start_msg["file_name"],
     }
-    msg["file_name"] = self.start_msg["file_name"]
     self.logging_collector.send(msg)
     if self.enable_async_logging:
-      self.logging_collector.send(None)
       self.logging_collector.wait()
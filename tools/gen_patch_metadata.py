@@ -3,23 +3,49 @@
 """
 import argparse
 import base64
+import concurrent.futures
+import contextlib
 import getpass
 import hashlib
+import html
+import json
 import logging
+import mmap
 import os
 import re
 import shutil
 import typing
-import urllib
+import urllib.parse
+from xml.etree import ElementTree
 import zipfile
 
-import bs4
+import lxml.etree
+import lxml.html
 import requests
+import urllib3
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
 SEARCH_FORM = 'https://updates.oracle.com/Orion/SimpleSearch/process_form?search_type=patch&patch_number=%d&plat_lang=226P'
 DOWNLOAD_URL = r'https://updates[.]oracle[.]com/Orion/Download/process_form[^\"]*'
 LOGIN_FORM = r'https://updates[.]oracle[.]com/Orion/SavedSearches/switch_to_simple'
+DOWNLOAD_CHUNK_SIZE = 4*1024*1024
+HASH_CHUNK_SIZE = 16*1024*1024
+# Suffix of the JSON file caching a patch's digest; deliberately not '.md5', which md5sum -c would expect
+MD5_SIDECAR_SUFFIX = '.md5.json'
+
+# Byte patterns so responses can be searched without decoding them first
+DOWNLOAD_URL_RE = re.compile(DOWNLOAD_URL.encode('ascii'))
+LOGIN_FORM_RE = re.compile(LOGIN_FORM.encode('ascii'))
+VERSION_RE = re.compile(r'(\d+\.\d+\.\d+\.\d+\.\d+)')
+TITLE_RE = re.compile(rb'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+OJVM_TITLE_RE = re.compile(r'JavaVM|OJVM')
+GI_TITLE_RE = re.compile(r'GI |Grid Infrastructure')
+DB_RU_TITLE_RE = re.compile(r'Release Update|% product_version %')
+
+# One gi_patches/rdbms_patches list item, as printed for the maintainer to paste
+PATCH_ENTRY = ('  - {{ category: "{category}", base: "{base}", release: "{release}", patchnum: "{patchnum}", '
+               'patchfile: "{patchfile}", patch_subdir: "/{patch_subdir}", prereq_check: {prereq_check}, '
+               'method: "{method}", ocm: false, upgrade: {upgrade}, md5sum: "{md5sum}", minimum_opatch: "{minimum_opatch}" }}')
 
 def get_patch_auth(s: requests.Session) -> typing.List[str]:
     """Obtains auth for login in order to download patches."""
@@ -27,7 +53,7 @@ def get_patch_auth(s: requests.Session) -> typing.List[str]:
     if 'location' in r.headers:
         r = s.get(r.headers['Location'])
     assert r.status_code == 200, f'Got HTTP code {r.status_code} retrieving {LOGIN_FORM}'
-    url = re.findall(LOGIN_FORM, str(r.content))
+    url = [u.decode('ascii', 'replace') for u in LOGIN_FORM_RE.findall(r.content)]
     return url
 
 def get_patch_url(s: requests.Session, patchnum: int) -> typing.List[str]:
@@ -36,17 +62,52 @@ def get_patch_url(s: requests.Session, patchnum: int) -> typing.List[str]:
     if 'location' in r.headers:
         r = s.get(r.headers['Location'])
     assert r.status_code == 200, f'Got HTTP code {r.status_code} retrieving {SEARCH_FORM}'
-    url = re.findall(DOWNLOAD_URL, str(r.content))
+    url = [u.decode('ascii', 'replace') for u in DOWNLOAD_URL_RE.findall(r.content)]
     assert url, f'Could not get a download URL from the patch form {SEARCH_FORM}; is the patch number correct?'
     return url
 
-def download_patch(s: requests.Session, url: str, patch_file: str) -> None:
-    """Downloads a given URL to a local file."""
+def get_patch_file(url: str) -> str:
+    """Returns the patch_file query parameter of a download URL."""
+    for param in urllib.parse.urlparse(url).query.split('&'):
+        if param.startswith('patch_file='):
+            return urllib.parse.unquote_plus(param[len('patch_file='):])
+    raise ValueError(f'No patch_file parameter in download URL {url}')
+
+def clone_session(s: requests.Session) -> requests.Session:
+    """Returns a new session sharing auth, headers, cookies and connection pools with s."""
+    c = requests.Session()
+    c.auth = s.auth
+    c.headers.update(s.headers)
+    c.cookies.update(s.cookies)
+    for prefix, adapter in s.adapters.items():
+        c.mount(prefix, adapter)
+    return c
+
+def download_patch(s: requests.Session, url: str, patch_file: str, hasher: typing.Optional[typing.Any] = None) -> None:
+    """Downloads a given URL to a local file, optionally feeding the bytes to a hash as they arrive."""
     logging.info('Downloading %s', url)
-    s.mount(url, requests.adapters.HTTPAdapter(max_retries=3))
-    with s.get(url, stream=True) as r:
-        with open(patch_file, 'wb') as f:
-            shutil.copyfileobj(r.raw, f)
+    try:
+        # The patch is already a zip, so ask for it uncompressed
+        with s.get(url, stream=True, headers={'Accept-Encoding': 'identity'}) as r:
+            with open(patch_file, 'wb') as f:
+                if hasher is None:
+                    shutil.copyfileobj(r.raw, f, DOWNLOAD_CHUNK_SIZE)
+                    return
+                while chunk := r.raw.read(DOWNLOAD_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+    except BaseException:
+        # Including Ctrl-C: a partial file would pass for a cached download on the next run
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(patch_file)
+        raise
+
+def get_file_size(path: str) -> int:
+    """Returns the size of a file with a single stat call, or 0 if it does not exist."""
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
 
 def get_min_opatch_version(op_patch_file: str) -> str:
     """Extracts numeric version from version.txt in OPatch zip."""
@@ -54,44 +115,116 @@ def get_min_opatch_version(op_patch_file: str) -> str:
         try:
             with z.open('OPatch/version.txt') as f:
                 content = f.read().decode('utf-8').strip()
-                match = re.search(r'(\d+\.\d+\.\d+\.\d+\.\d+)', content)
+                match = VERSION_RE.search(content)
                 return match.group(1) if match else content
         except KeyError:
             logging.warning('Could not find OPatch/version.txt in %s', op_patch_file)
             return "unknown"
 
+def decode_readme_text(raw: bytes) -> str:
+    """Decodes README bytes, trying ASCII and UTF-8 before latin-1, which cannot fail."""
+    if raw.isascii():
+        return raw.decode('ascii')
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+def get_readme_title(content: bytes) -> str:
+    """Returns the title of a README.html, falling back to its doctitle meta tag."""
+    m = TITLE_RE.search(content)
+    title = html.unescape(decode_readme_text(m.group(1))).strip() if m else ""
+    if not title:
+        # Only build a tree when the title is missing or empty
+        try:
+            meta_title = lxml.html.fromstring(content).find('.//meta[@name="doctitle"]')
+        except lxml.etree.ParserError:
+            # lxml rejects empty documents; treat them as untitled
+            meta_title = None
+        title = meta_title.get('content', "") if meta_title is not None else ""
+    return title
+
+def get_md5_digest(patch_file: str) -> str:
+    """Returns the base64-encoded MD5 digest of a file."""
+    with open(patch_file, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    # Let the kernel read ahead aggressively while OpenSSL hashes
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                md5 = hashlib.md5(mm)
+        except (ValueError, OSError):
+            # Empty files and some filesystems cannot be mapped
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            md5 = hashlib.md5()
+            buf = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buf)
+            while n := f.readinto(buf):
+                md5.update(view[:n])
+    return base64.b64encode(md5.digest()).decode('ascii')
+
+def load_md5_sidecar(patch_file: str) -> typing.Optional[str]:
+    """Returns the digest cached next to a patch file if its size and mtime still match."""
+    try:
+        st = os.stat(patch_file)
+        with open(patch_file + MD5_SIDECAR_SUFFIX) as f:
+            cached = json.load(f)
+        if cached['size'] == st.st_size and cached['mtime_ns'] == st.st_mtime_ns:
+            return cached['digest']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def save_md5_sidecar(patch_file: str, digest: str) -> None:
+    """Caches a patch file's digest, keyed by its size and mtime, in a .md5.json sidecar file."""
+    sidecar = patch_file + MD5_SIDECAR_SUFFIX
+    try:
+        st = os.stat(patch_file)
+        with open(sidecar + '.tmp', 'w') as f:
+            json.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': digest}, f)
+        os.replace(sidecar + '.tmp', sidecar)
+    except OSError as e:
+        logging.warning('Could not write %s: %s', sidecar, e)
+
 def parse_patch(patch_file: str, patchnum: int) -> (str, str, str, str, str, bool):
     """Parses patch metadata and identifies subdirectories."""
     is_gi = False
     with zipfile.ZipFile(patch_file, 'r') as z:
+        abstract, release = None, None
         with z.open('PatchSearch.xml') as f:
-            c = bs4.BeautifulSoup(f.read(), 'xml')
-            abstract = c.find('abstract').get_text()
-            logging.info('Abstract: %s', abstract)
-            ver_match = re.search(r'(\d+\.\d+\.\d+\.\d+\.\d+)', abstract)
-            patch_release = ver_match.group(1) if ver_match else "unknown"
-            release_tag = c.find('release')
-            release = release_tag['name'] if release_tag else "unknown"
+            # Stream the two elements we need rather than building the whole tree
+            for _, el in ElementTree.iterparse(f):
+                if el.tag == 'abstract' and abstract is None:
+                    abstract = el.text or ''
+                elif el.tag == 'release' and release is None:
+                    release = el.get('name', "unknown")
+                el.clear()
+                if abstract is not None and release is not None:
+                    break
+        abstract = abstract or ''
+        release = release or "unknown"
+        logging.info('Abstract: %s', abstract)
+        ver_match = VERSION_RE.search(abstract)
+        patch_release = ver_match.group(1) if ver_match else "unknown"
 
         gi_subdir, ojvm_subdir, db_subdir = None, None, None
-        for fname in z.namelist():
-            m = re.search(fr'^{patchnum}/(\d+)/README.html', fname)
-            if m:
-                subdir_candidate = m.group(1)
-                with z.open(fname) as f:
-                    c = bs4.BeautifulSoup(f.read(), 'lxml')
-                    title = c.find('title').get_text().strip() if c.find('title') else ""
-                    if not title:
-                        meta_title = c.find('meta', attrs={'name': 'doctitle'})
-                        title = meta_title['content'] if meta_title else ""
-                    logging.debug('Inspecting subdir %s with title: "%s"', subdir_candidate, title)
-
-                    if any(x in title for x in ['JavaVM', 'OJVM']):
-                        ojvm_subdir = subdir_candidate
-                    elif any(x in title for x in ['GI ', 'Grid Infrastructure', 'GI Release Update']):
-                        gi_subdir = subdir_candidate
-                    elif 'Database' in title and ('Release Update' in title or '% product_version %' in title):
-                        db_subdir = subdir_candidate
+        readme_re = re.compile(fr'{patchnum}/(\d+)/README.html')
+        readmes = {m.group(1): info for info in z.infolist() if (m := readme_re.match(info.filename))}
+        for subdir_candidate, info in readmes.items():
+            with z.open(info) as f:
+                title = get_readme_title(f.read())
+            logging.debug('Inspecting subdir %s with title: "%s"', subdir_candidate, title)
+
+            if OJVM_TITLE_RE.search(title):
+                ojvm_subdir = subdir_candidate
+            elif GI_TITLE_RE.search(title):
+                gi_subdir = subdir_candidate
+            elif 'Database' in title and DB_RU_TITLE_RE.search(title):
+                db_subdir = subdir_candidate
+            # A GI combo needs nothing else; a DB subdir is unused once a GI subdir is known
+            if ojvm_subdir and gi_subdir:
+                break
 
     if gi_subdir or "GI RELEASE UPDATE" in abstract.upper():
         is_gi = True
@@ -115,21 +248,52 @@ def main():
 
     s = requests.Session()
     s.headers.update({'User-Agent': USER_AGENT})
+    # One pooled adapter for the whole run so auth, search and downloads reuse connections
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=8,
+        # raise_on_status=False returns the last 5xx response so callers can report the status code
+        max_retries=urllib3.util.Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504],
+                                       raise_on_status=False))
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
     s.auth = (args.mosuser, getpass.getpass(prompt='MOS Password: '))
 
     url_list = get_patch_url(s, args.patch)
-    patch_file = urllib.parse.parse_qs(urllib.parse.urlparse(url_list[0]).query)['patch_file'][0]
-    
-    if not (os.path.exists(patch_file) and os.path.getsize(patch_file) > 100*1024*1024):
-        download_patch(s, url_list[0], patch_file)
+    patch_file = get_patch_file(url_list[0])
 
-    md5 = hashlib.md5()
-    with open(patch_file, 'rb') as f:
-        while chunk := f.read(1024*1024):
-            md5.update(chunk)
-    md5_digest = base64.b64encode(md5.digest()).decode('ascii')
+    op_url = get_patch_url(s, 6880880)
+    opatch_release = patch_file.split('_')[1][:5]
+    op_match = next((k for k in op_url if opatch_release in k), None)
+    assert op_match, f'Could not find an OPatch download for release {opatch_release}'
+    op_patch_file = get_patch_file(op_match)
+
+    # The small OPatch zip downloads in the background while the patch itself downloads
+    # on the main thread, where Ctrl-C can still interrupt it
+    md5 = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
+        op_download = None
+        if not os.path.exists(op_patch_file):
+            op_download = ex.submit(download_patch, clone_session(s), op_match, op_patch_file)
+        if get_file_size(patch_file) <= 100*1024*1024:
+            md5 = hashlib.md5()
+            download_patch(s, url_list[0], patch_file, md5)
+        if op_download:
+            op_download.result()
+    if md5:
+        md5_digest = base64.b64encode(md5.digest()).decode('ascii')
+        save_md5_sidecar(patch_file, md5_digest)
+    else:
+        md5_digest = load_md5_sidecar(patch_file)
 
-    (release_name, patch_release, ojvm_subdir, gi_subdir, db_subdir, is_gi) = parse_patch(patch_file, args.patch)
+    # A cached patch without a valid sidecar still needs hashing; that reads the whole
+    # file while parsing only touches a few members, so overlap them
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as ex:
+        md5_future = ex.submit(get_md5_digest, patch_file) if md5_digest is None else None
+        parse_future = ex.submit(parse_patch, patch_file, args.patch)
+        (release_name, patch_release, ojvm_subdir, gi_subdir, db_subdir, is_gi) = parse_future.result()
+        if md5_future:
+            md5_digest = md5_future.result()
+            save_md5_sidecar(patch_file, md5_digest)
 
     BASE_OVERRIDES = {
         '23.0.0.0.0': '23.26.1.0.0',
@@ -141,26 +305,24 @@ def main():
     prereq_flag = 'false' if major_ver >= 21 else 'true'
     upgrade_flag = 'false' if major_ver >= 21 else 'true'
 
-    op_url = get_patch_url(s, 6880880)
-    major_ver = patch_file.split('_')[1][:5]
-    op_match = [k for k in op_url if major_ver in k][0]
-    op_patch_file = urllib.parse.parse_qs(urllib.parse.urlparse(op_match).query)['patch_file'][0]
-    if not os.path.exists(op_patch_file):
-        download_patch(s, op_match, op_patch_file)
     min_opatch = get_min_opatch_version(op_patch_file)
 
+    entry = {'base': base_release, 'release': patch_release, 'patchnum': args.patch, 'patchfile': patch_file,
+             'prereq_check': prereq_flag, 'method': 'opatch apply', 'upgrade': upgrade_flag,
+             'md5sum': md5_digest, 'minimum_opatch': min_opatch}
     if is_gi:
         print(f"Add to roles/common/defaults/main/gi_patches.yml:")
-        print(f'  - {{ category: "RU", base: "{base_release}", release: "{patch_release}", patchnum: "{args.patch}", patchfile: "{patch_file}", patch_subdir: "/{gi_subdir if gi_subdir is not None else ""}", prereq_check: false, method: "opatchauto apply", ocm: false, upgrade: false, md5sum: "{md5_digest}", minimum_opatch: "{min_opatch}" }}')
+        print(PATCH_ENTRY.format_map({**entry, 'category': 'RU', 'patch_subdir': gi_subdir if gi_subdir is not None else "",
+                                      'prereq_check': 'false', 'method': 'opatchauto apply', 'upgrade': 'false'}))
         if release_name.startswith('19') and ojvm_subdir:
             print(f"\nAdd to roles/common/defaults/main/rdbms_patches.yml:")
-            print(f'  - {{ category: "RU_Combo", base: "{base_release}", release: "{patch_release}", patchnum: "{args.patch}", patchfile: "{patch_file}", patch_subdir: "/{ojvm_subdir}", prereq_check: {prereq_flag}, method: "opatch apply", ocm: false, upgrade: {upgrade_flag}, md5sum: "{md5_digest}", minimum_opatch: "{min_opatch}" }}')
+            print(PATCH_ENTRY.format_map({**entry, 'category': 'RU_Combo', 'patch_subdir': ojvm_subdir}))
     else:
         print(f"Add to roles/common/defaults/main/rdbms_patches.yml:")
         if release_name.startswith('19') and ojvm_subdir:
-            print(f'  - {{ category: "DB_OJVM_RU", base: "{base_release}", release: "{patch_release}", patchnum: "{args.patch}", patchfile: "{patch_file}", patch_subdir: "/{ojvm_subdir}", prereq_check: {prereq_flag}, method: "opatch apply", ocm: false, upgrade: {upgrade_flag}, md5sum: "{md5_digest}", minimum_opatch: "{min_opatch}" }}')
+            print(PATCH_ENTRY.format_map({**entry, 'category': 'DB_OJVM_RU', 'patch_subdir': ojvm_subdir}))
         if db_subdir is not None:
-            print(f'  - {{ category: "DB_RU", base: "{base_release}", release: "{patch_release}", patchnum: "{args.patch}", patchfile: "{patch_file}", patch_subdir: "/{db_subdir}", prereq_check: {prereq_flag}, method: "opatch apply", ocm: false, upgrade: {upgrade_flag}, md5sum: "{md5_digest}", minimum_opatch: "{min_opatch}" }}')
+            print(PATCH_ENTRY.format_map({**entry, 'category': 'DB_RU', 'patch_subdir': db_subdir}))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,150 @@
+import copy
+import json
+import os
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+import requests
+
+# The tests live outside callback_plugins because Ansible tries to load every
+# module under a callback plugin path, including subdirectories, as a plugin.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "callback_plugins"))
+import ansible_cloud_logging
+from ansible_cloud_logging import CloudLoggingCollector
+
+
+def _response(status_code, body=b"{}", headers=None):
+  """Builds a requests.Response as returned by AuthorizedSession.post()."""
+  resp = requests.Response()
+  resp.status_code = status_code
+  resp._content = body
+  resp.headers.update(headers or {})
+  return resp
+
+
+class TestCloudLoggingCollector(unittest.TestCase):
+
+  def setUp(self):
+    self._patch(google.auth, "default", return_value=(None, "test-project"))
+    self.post = self._patch(AuthorizedSession, "post", return_value=_response(200))
+    self.sleep = self._patch(ansible_cloud_logging.time, "sleep")
+    self._patch(ansible_cloud_logging.random, "random", return_value=0.0)
+
+  def _patch(self, target, attribute, **kwargs):
+    patcher = patch.object(target, attribute, **kwargs)
+    self.addCleanup(patcher.stop)
+    return patcher.start()
+
+  def _collector(self, **kwargs):
+    kwargs.setdefault("enable_async_logging", False)
+    kwargs.setdefault("ignore_gcp_api_errors", True)
+    return CloudLoggingCollector("test-project", "test-log", **kwargs)
+
+  def _posted_entries(self, call):
+    return json.loads(call.kwargs["data"])["entries"]
+
+  def test_retries_after_rate_limit_honoring_retry_after(self):
+    self.post.side_effect = [
+        _response(429, headers={"Retry-After": "7"}),
+        _response(200),
+    ]
+    self._collector().send({"id": "1"})
+
+    self.assertEqual(self.post.call_count, 2)
+    self.sleep.assert_called_once_with(7.0)
+
+  def test_retries_server_error_with_exponential_backoff(self):
+    self.post.side_effect = [_response(503), _response(503), _response(200)]
+    self._collector().send({"id": "1"})
+
+    self.assertEqual(self.post.call_count, 3)
+    self.assertEqual(
+        [call.args[0] for call in self.sleep.call_args_list],
+        [ansible_cloud_logging.RETRY_BASE_DELAY, ansible_cloud_logging.RETRY_BASE_DELAY * 2],
+    )
+
+  def test_error_response_without_json_body_is_reported(self):
+    self.post.return_value = _response(400, body=b"<html>Bad Request</html>")
+    with patch("builtins.print") as mock_print:
+      self._collector().send({"id": "1"})
+
+    self.assertIn("<html>Bad Request</html>", mock_print.call_args_list[0].args[0])
+
+  def test_persistent_error_exits_unless_ignored(self):
+    self.post.side_effect = requests.exceptions.ConnectionError("refused")
+    with patch("builtins.print"):
+      with self.assertRaises(SystemExit):
+        self._collector(ignore_gcp_api_errors=False).send({"id": "1"})
+
+  def test_circuit_breaker_opens_and_recovers(self):
+    self.post.side_effect = requests.exceptions.ConnectionError("refused")
+    collector = self._collector()
+    with patch("builtins.print"):
+      collector.send({"id": "1"})
+      self.assertEqual(self.post.call_count, ansible_cloud_logging.MAX_SEND_ATTEMPTS)
+
+      # While the breaker is open, sends fail without a request.
+      collector.send({"id": "2"})
+      self.assertEqual(self.post.call_count, ansible_cloud_logging.MAX_SEND_ATTEMPTS)
+
+    self.post.side_effect = None
+    after_cooldown = time.monotonic() + ansible_cloud_logging.CIRCUIT_BREAKER_COOLDOWN + 1
+    with patch.object(ansible_cloud_logging.time, "monotonic", return_value=after_cooldown):
+      collector.send({"id": "3"})
+
+    self.assertEqual(self.post.call_count, ansible_cloud_logging.MAX_SEND_ATTEMPTS + 1)
+    self.assertEqual(self._posted_entries(self.post.call_args), [{"jsonPayload": {"id": "3"}}])
+    self.assertEqual(collector.circuit_open_until, 0.0)
+
+  def test_wait_drains_partial_batch(self):
+    collector = self._collector(
+        enable_async_logging=True, batch_max_entries=10, batch_flush_interval=60
+    )
+    collector.start_consuming()
+    for i in range(3):
+      collector.send({"id": str(i)})
+    collector.wait()
+
+    self.assertEqual(self.post.call_count, 1)
+    self.assertEqual(
+        self._posted_entries(self.post.call_args),
+        [{"jsonPayload": {"id": str(i)}} for i in range(3)],
+    )
+    self.assertFalse(any(consumer.is_alive() for consumer in collector.consumers))
+
+
+class TestTruncateResultFields(unittest.TestCase):
+
+  def test_truncates_loop_results_without_modifying_the_input(self):
+    long_output = "x" * (ansible_cloud_logging.MAX_RESULT_FIELD_SIZE + 100)
+    result = {
+        "changed": True,
+        "stdout": long_output,
+        "stdout_lines": [long_output],
+        "results": [
+            {"item": 1, "stdout": long_output, "stdout_lines": [long_output]},
+            {"item": 2, "stdout": "short"},
+        ],
+    }
+    original = copy.deepcopy(result)
+
+    truncated = ansible_cloud_logging._truncate_result_fields(result)
+
+    self.assertEqual(result, original)
+    self.assertTrue(truncated["stdout"].endswith("...[truncated 100 characters]"))
+    self.assertNotIn("stdout_lines", truncated)
+    self.assertTrue(truncated["results"][0]["stdout"].endswith("...[truncated 100 characters]"))
+    self.assertNotIn("stdout_lines", truncated["results"][0])
+    self.assertIs(truncated["results"][1], result["results"][1])
+
+  def test_returns_small_result_unchanged(self):
+    result = {"stdout": "short", "results": [{"stdout": "short"}]}
+    self.assertIs(ansible_cloud_logging._truncate_result_fields(result), result)
+
+
+if __name__ == "__main__":
+  unittest.main()